@@ -1,88 +1,232 @@
-import subprocess
-import time
-from pathlib import Path
+import asyncio
+import codecs
+import collections
+import http.client
+import json
 import os
-import shutil
-import select
 import pty
+import re
+import selectors
+import shutil
+import subprocess
 import sys
-from dotenv import load_dotenv
+import time
+import urllib.parse
+from dataclasses import dataclass
 from pathlib import Path
-import json
 
-load_dotenv()  # Loads .env from repo root
+from dotenv import load_dotenv
+
 # =========================
 # CONFIGURATION
 # =========================
 
-REPO_PATH = Path(os.getenv("REPO_PATH")).resolve()
-PROD_URL = os.getenv("PROD_URL")
 
-GIT_REMOTE = os.getenv("GIT_REMOTE", "origin")
-GIT_BRANCH = os.getenv("GIT_BRANCH", "main")
+@dataclass(frozen=True)
+class Config:
+    """Loop settings, read from the environment (and .env) once at startup."""
+
+    repo_path: Path
+    prod_url: str | None
+    git_remote: str
+    git_branch: str
+    vercel_token: str | None
+    vercel_team_id: str
+    vercel_api_host: str
+    codex_cmd: tuple[str, ...]
+    codex_use_exec: bool
+    max_iterations: int
+    sleep_after_push_seconds: int
+    # Upper bound on waiting for a pushed commit's deployment to appear and finish.
+    deploy_wait_timeout_seconds: int
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        load_dotenv()  # Loads .env from repo root
+        repo_path = os.getenv("REPO_PATH")
+        if not repo_path:
+            raise SystemExit("REPO_PATH is not set; see .env.example.")
+        return cls(
+            repo_path=Path(repo_path).resolve(),
+            prod_url=os.getenv("PROD_URL"),
+            git_remote=os.getenv("GIT_REMOTE", "origin"),
+            git_branch=os.getenv("GIT_BRANCH", "main"),
+            vercel_token=os.getenv("VERCEL_TOKEN"),
+            vercel_team_id=os.getenv("VERCEL_TEAM_ID", ""),
+            vercel_api_host=os.getenv("VERCEL_API_HOST", "api.vercel.com"),
+            # Convert command string to a list
+            codex_cmd=tuple(os.getenv("CODEX_CMD", "echo NO_CHANGES").split()),
+            codex_use_exec=os.getenv("CODEX_USE_EXEC", "1") != "0",
+            max_iterations=int(os.getenv("MAX_ITERATIONS", 10)),
+            sleep_after_push_seconds=int(os.getenv("SLEEP_AFTER_PUSH_SECONDS", 90)),
+            deploy_wait_timeout_seconds=int(os.getenv("DEPLOY_WAIT_TIMEOUT_SECONDS", 600)),
+        )
+
+
+CONFIG = Config.from_env()
+
+# Environment for `vercel` subprocesses, built once instead of per call.
+# Treat as read-only; subprocesses get their own copy anyway.
+_VERCEL_ENV = {
+    **os.environ,
+    **({"VERCEL_AUTH_TOKEN": CONFIG.vercel_token} if CONFIG.vercel_token else {}),
+    **({"VERCEL_TEAM_ID": CONFIG.vercel_team_id} if CONFIG.vercel_team_id else {}),
+}
+
+# Same for Codex runs: unbuffered child output and a default log level.
+# It can reuse OpenAI CLI auth, or set CODEX_API_KEY in .env.
+_CODEX_ENV = {"CODEX_LOG_LEVEL": "info", **os.environ, "PYTHONUNBUFFERED": "1"}
+
+# Executables resolved on PATH once, so each spawn skips the PATH search.
+# A missing one keeps its bare name and fails the usual way when run.
+GIT = shutil.which("git") or "git"
+VERCEL = shutil.which("vercel") or "vercel"
+CODEX = shutil.which("codex") or "codex"
 
-VERCEL_TOKEN = os.getenv("VERCEL_TOKEN")
+# HEAD only moves when git_commit_and_push commits, so cache the hash until then.
+_HEAD_CACHE: dict[bool, str] = {}
 
-# Convert command string to a list
-CODEX_CMD = os.getenv("CODEX_CMD", "echo NO_CHANGES").split()
-CODEX_USE_EXEC = os.getenv("CODEX_USE_EXEC", "1") != "0"
+# Long-lived `git cat-file --batch-check` used to resolve revisions without
+# spawning a new git process per lookup. Started lazily by resolve_git_rev().
+_GIT_BATCH: subprocess.Popen | None = None
 
-MAX_ITERATIONS = int(os.getenv("MAX_ITERATIONS", 10))
-SLEEP_AFTER_PUSH_SECONDS = int(os.getenv("SLEEP_AFTER_PUSH_SECONDS", 90))
-VERCEL_TEAM_ID = os.getenv("VERCEL_TEAM_ID", "")
+# Kept-alive connection to the Vercel REST API, opened by vercel_api_get().
+_VERCEL_API_CONN: http.client.HTTPSConnection | None = None
+
+# Remembers the last commit whose build looked successful, so rerunning the
+# loop on an unchanged HEAD only needs one deployment-state API call to
+# confirm it. Kept inside .git so it is never committed.
+_STATE_FILE = CONFIG.repo_path / ".git" / "vercel_codex_loop.json"
+
+# Paths `git status` reported right after a `codex exec` run. The next
+# git_commit_and_push stages exactly these (None means `git add -A`).
+_PATHS_TO_STAGE: list[str] | None = None
 
 # =========================
 # HELPER FUNCTIONS
 # =========================
 
-import json  # you can keep this import if already there, it's harmless
-
-
-def git_workdir_has_changes() -> bool:
+def git_dirty_paths() -> tuple[bool, list[str]]:
     """
-    Return True if there are unstaged or staged changes in the repo.
+    Return (tracked changes exist, paths that still need staging) from one
+    `git status` call. Paths are untracked files plus tracked files with
+    unstaged edits or deletions; index-only changes are already staged.
+    Staging exactly these paths spares `git add` its own worktree scan.
     """
-    # unstaged
     result = subprocess.run(
-        ["git", "diff", "--quiet"],
-        cwd=REPO_PATH,
-        text=True,
+        [GIT, "status", "--porcelain", "-z"],
+        cwd=CONFIG.repo_path,
+        capture_output=True,
+        check=True,
+        close_fds=False,
     )
-    if result.returncode != 0:
-        return True
+    fields = result.stdout.split(b"\0")
+    has_tracked_changes = False
+    paths: list[str] = []
+    i = 0
+    while i < len(fields):
+        entry = fields[i]
+        i += 1
+        if len(entry) < 4:
+            continue
+        status = entry[:2]
+        if status[:1] in (b"R", b"C"):
+            # Renames and copies carry their (already staged) source path next.
+            i += 1
+        if status[1:] != b" ":
+            paths.append(os.fsdecode(entry[3:]))
+        if status != b"??":
+            has_tracked_changes = True
+    return has_tracked_changes, paths
 
-    # staged
-    result = subprocess.run(
-        ["git", "diff", "--cached", "--quiet"],
-        cwd=REPO_PATH,
-        text=True,
-    )
-    return result.returncode != 0
+
+def is_blank(text: str) -> bool:
+    """Whitespace-only check that doesn't copy the string like `text.strip()`."""
+    return not text or text.isspace()
 
 
-def run(cmd, cwd=None, input_text=None, check=True, env=None, encoding="utf-8", errors="replace"):
+async def run_async(cmd, cwd=None, input_text=None, check=True, env=None, encoding="utf-8", errors="replace"):
     """
-    Run a shell command and return stdout as text.
+    Run a command and return (stdout, stderr, returncode) as text, awaiting
+    the child so other tasks keep running meanwhile.
     Raises RuntimeError on non-zero exit code if check=True.
+    The child is killed if the awaiting task is cancelled.
     """
-    result = subprocess.run(
-        cmd,
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
         cwd=cwd,
-        input=input_text,
-        text=True,
-        capture_output=True,
+        stdin=asyncio.subprocess.PIPE if input_text is not None else None,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
         env=env,
-        encoding=encoding,
-        errors=errors,
+        # Python's own fds are non-inheritable already (PEP 446); skipping
+        # the close-all-fds pass keeps short git calls cheap.
+        close_fds=False,
     )
-    if check and result.returncode != 0:
+    try:
+        out, err = await proc.communicate(
+            input_text.encode(encoding, errors) if input_text is not None else None
+        )
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    stdout = out.decode(encoding, errors)
+    stderr = err.decode(encoding, errors)
+    if check and proc.returncode != 0:
         raise RuntimeError(
             f"Command failed: {' '.join(cmd)}\n"
-            f"Exit code: {result.returncode}\n"
-            f"STDOUT:\n{result.stdout}\n"
-            f"STDERR:\n{result.stderr}"
+            f"Exit code: {proc.returncode}\n"
+            f"STDOUT:\n{stdout}\n"
+            f"STDERR:\n{stderr}"
+        )
+    return stdout, stderr, proc.returncode
+
+
+async def run_quiet(cmd, cwd=None, input_text=None, check=True, env=None, encoding="utf-8", errors="replace") -> int:
+    """
+    Like run_async() for commands whose output is only interesting when they
+    fail: stdout goes to /dev/null and only stderr is buffered, for the error
+    message. Returns the exit code.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=cwd,
+        stdin=asyncio.subprocess.PIPE if input_text is not None else None,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+        close_fds=False,  # same as run_async()
     )
-    return result.stdout, result.stderr, result.returncode
+    try:
+        _, err = await proc.communicate(
+            input_text.encode(encoding, errors) if input_text is not None else None
+        )
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if check and proc.returncode != 0:
+        raise RuntimeError(
+            f"Command failed: {' '.join(cmd)}\n"
+            f"Exit code: {proc.returncode}\n"
+            f"STDERR:\n{err.decode(encoding, errors)}"
+        )
+    return proc.returncode
+
+
+# Read PTY output in large blocks; chatty Codex runs produce megabytes.
+PTY_CHUNK = 64 * 1024
+_NS = 1_000_000_000
+# What run_with_pty answers: a cursor position query (ESC[6n) and the
+# confirmation prompts auto_yes approves. One pass finds all of them.
+_PTY_PROMPT_RE = re.compile(
+    rb"(?P<cursor>\x1b\[6n)"
+    rb"|(?P<run_cmd>Would you like to run the following command\?)"
+    rb"|(?P<confirm>Press enter to confirm)"
+)
 
 
 def run_with_pty(
@@ -116,48 +260,92 @@ def run_with_pty(
     finally:
         os.close(slave_fd)
 
-    output = bytearray()
-    start = time.time()
+    # Decode as chunks arrive; the incremental decoder carries multi-byte
+    # characters split across reads, so no full-size decode is left at exit.
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    output: list[str] = []
+    # All timers are integer nanoseconds on the monotonic clock, so wall
+    # clock jumps can't fire or stall them.
+    heartbeat_ns = 10 * _NS
+    kill_grace_ns = 3 * _NS
+    nudge_ns = int(nudge_after_silence * _NS)
+    start = time.monotonic_ns()
     last_output = start
     last_heartbeat = start
     timed_out = False
     killed = False
     terminate_at = None
-    timeout_deadline = start + timeout_seconds if timeout_seconds else None
+    timeout_deadline = start + int(timeout_seconds * _NS) if timeout_seconds else None
 
     if input_text:
+        payload = input_text.encode("utf-8", errors="replace") + b"\n"
+        if send_eot:
+            # Send Ctrl-D to signal EOF to interactive programs
+            payload += b"\x04"
         try:
-            os.write(master_fd, input_text.encode("utf-8", errors="replace"))
-            os.write(master_fd, b"\n")
-            if send_eot:
-                # Send Ctrl-D to signal EOF to interactive programs
-                os.write(master_fd, b"\x04")
+            # One write hands the whole input to the line discipline at once.
+            os.write(master_fd, payload)
         except OSError:
             pass
 
+    # Wait on events instead of waking every 100ms: PTY output, child exit
+    # (via a pidfd on Linux), or the next timer deadline below.
+    sel = selectors.DefaultSelector()
+    sel.register(master_fd, selectors.EVENT_READ, "pty")
+    pidfd = None
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+            sel.register(pidfd, selectors.EVENT_READ, "exit")
+        except OSError:
+            pidfd = None
+    exited = False
+    eof = False
+
     # Read until the process exits. If the child requests cursor position
     # (ESC[6n), respond with a dummy value to satisfy TTY probes.
     while True:
-        now = time.time()
+        now = time.monotonic_ns()
         if timeout_deadline and now > timeout_deadline and not timed_out:
             timed_out = True
             terminate_at = now
             print("[warn] PTY command exceeded timeout; terminating...", flush=True)
             proc.terminate()
-        if timed_out and not killed and terminate_at and (now - terminate_at) > 3.0:
+        if timed_out and not killed and terminate_at and (now - terminate_at) > kill_grace_ns:
             killed = True
             print("[warn] PTY process did not exit; killing...", flush=True)
             proc.kill()
 
-        ready, _, _ = select.select([master_fd], [], [], 0.1)
-        if master_fd in ready:
+        # Sleep until the earliest pending timer: timeout, kill, heartbeat, nudge.
+        deadlines = [max(last_output, last_heartbeat) + heartbeat_ns]
+        if timeout_deadline and not timed_out:
+            deadlines.append(timeout_deadline)
+        if timed_out and not killed:
+            deadlines.append(terminate_at + kill_grace_ns)
+        if nudge_ns:
+            deadlines.append(last_output + nudge_ns)
+        if pidfd is None:
+            # No exit notification; fall back to polling proc.poll().
+            deadlines.append(now + _NS // 10)
+        events = sel.select(max(0, min(deadlines) - now) / _NS)
+
+        now = time.monotonic_ns()
+        ready = False
+        for key, _ in events:
+            if key.data == "exit":
+                exited = True
+                continue
+            ready = True
             try:
-                chunk = os.read(master_fd, 1024)
+                chunk = os.read(master_fd, PTY_CHUNK)
             except OSError:
+                eof = True
                 break
             if not chunk:
+                eof = True
                 break
-            if b"\x1b[6n" in chunk:
+            found = {match.lastgroup for match in _PTY_PROMPT_RE.finditer(chunk)}
+            if "cursor" in found:
                 # Respond with row 1, col 1
                 try:
                     os.write(master_fd, b"\x1b[1;1R")
@@ -165,7 +353,7 @@ def run_with_pty(
                     pass
                 # Remove the query from captured output to keep logs clean
                 chunk = chunk.replace(b"\x1b[6n", b"")
-            output.extend(chunk)
+            output.append(decoder.decode(chunk))
             if stream_to_stdout and chunk:
                 try:
                     sys.stdout.buffer.write(chunk)
@@ -175,46 +363,53 @@ def run_with_pty(
             if chunk:
                 last_output = now
             # Auto-approve common prompts from tools that block on confirmation
-            if auto_yes and b"Would you like to run the following command?" in chunk:
+            if auto_yes and "run_cmd" in found:
                 try:
                     os.write(master_fd, b"y\n")
                 except OSError:
                     pass
-            if auto_yes and b"Press enter to confirm" in chunk:
+            if auto_yes and "confirm" in found:
                 try:
                     os.write(master_fd, b"\n")
                 except OSError:
                     pass
+        if eof:
+            break
 
         # Heartbeat to reassure liveness when nothing is printed
-        if (now - last_output) > 10 and (now - last_heartbeat) > 10:
+        if (now - last_output) > heartbeat_ns and (now - last_heartbeat) > heartbeat_ns:
             print("[info from the loop] PTY command still running (no new output)...", flush=True)
             last_heartbeat = now
 
         # If totally silent for a while, send a gentle newline to nudge REPL-ish UIs
-        if nudge_after_silence and (now - last_output) > nudge_after_silence:
+        if nudge_ns and (now - last_output) > nudge_ns:
+            # Reset the silence timer even if the write fails, so a dead PTY
+            # doesn't turn this deadline into a busy loop.
+            last_output = now
             try:
                 os.write(master_fd, b"\n")
-                last_output = now
                 print("[debug from the loop] Sent newline to nudge interactive prompt.", flush=True)
             except OSError:
                 pass
 
-        if proc.poll() is not None and not ready:
+        if (exited or proc.poll() is not None) and not ready:
             break
 
+    if pidfd is not None:
+        sel.unregister(pidfd)
+        os.close(pidfd)
+
     # Drain any trailing output after process exit
     while True:
-        ready, _, _ = select.select([master_fd], [], [], 0.1)
-        if master_fd not in ready:
+        if not sel.select(0.1):
             break
         try:
-            chunk = os.read(master_fd, 1024)
+            chunk = os.read(master_fd, PTY_CHUNK)
         except OSError:
             break
         if not chunk:
             break
-        output.extend(chunk)
+        output.append(decoder.decode(chunk))
         if stream_to_stdout and chunk:
             try:
                 sys.stdout.buffer.write(chunk)
@@ -222,6 +417,7 @@ def run_with_pty(
             except Exception:
                 pass
 
+    sel.close()
     try:
         os.close(master_fd)
     except OSError:
@@ -234,31 +430,115 @@ def run_with_pty(
             rc = proc.wait()
     else:
         rc = proc.wait()
-    text_out = output.decode("utf-8", errors="replace")
+    output.append(decoder.decode(b"", final=True))
+    text_out = "".join(output)
     return text_out, "", rc
 
 
-def fetch_latest_build_logs() -> str:
-    """Fetch logs for the deployment that corresponds to the current HEAD commit."""
+# Lines Vercel prints once a build has already failed. What follows is
+# teardown, so Codex can start on the logs received so far.
+_BUILD_FAILED_MARKERS = (
+    "build failed",
+    "exit code 1",
+    "command \"npm run build\" exited with 1",
+)
+# Last lines of a successful deployment; nothing useful is printed after them.
+_DEPLOY_DONE_MARKERS = (
+    "deployment completed",
+    "ready! deployed to",
+)
+# Only the tail of the build log is kept; errors are reported at the end.
+LOG_TAIL_LINES = 2000
+# Codex only gets the end of that tail: the error is there, and every extra
+# character is prompt tokens. dev_debug_logs.md still has the full tail.
+CODEX_LOG_TAIL_CHARS = 32 * 1024
+
+
+def codex_log_tail(logs: str) -> str:
+    """Last CODEX_LOG_TAIL_CHARS of logs, cut at a line boundary."""
+    if len(logs) <= CODEX_LOG_TAIL_CHARS:
+        return logs
+    cut = len(logs) - CODEX_LOG_TAIL_CHARS
+    newline = logs.find("\n", cut)
+    return logs[newline + 1 if newline != -1 else cut:]
+
+
+async def _read_lines(stream: asyncio.StreamReader, lines, on_line=None) -> None:
+    """Decode a child's output line by line into `lines` as it arrives."""
+    async for raw in stream:
+        line = raw.decode("utf-8", errors="replace")
+        lines.append(line)
+        if on_line:
+            on_line(line)
+
+
+async def fetch_latest_build_logs(dep_id: str | None = None, on_build_failed=None) -> str:
+    """
+    Fetch logs for the deployment that corresponds to the current HEAD commit.
+    Pass dep_id when it is already known to skip the deployment lookup.
+
+    Logs are streamed while the build runs and only the last LOG_TAIL_LINES
+    lines are kept. If on_build_failed is given, it is called once with the
+    stdout received so far as soon as a build-failure line shows up. Once a
+    final failure or deployment-done line arrives, `vercel inspect` is
+    stopped instead of waiting for it to exit on its own.
+    """
     print("\n[step] Fetching Vercel build logs for current commit...")
 
-    env = os.environ.copy()
-    if VERCEL_TOKEN:
-        env["VERCEL_AUTH_TOKEN"] = VERCEL_TOKEN
-    if VERCEL_TEAM_ID:
-        env["VERCEL_TEAM_ID"] = VERCEL_TEAM_ID
-
-    dep_id = get_deployment_id_for_current_commit()
+    dep_id = dep_id or await get_deployment_id_for_current_commit()
     if not dep_id:
         print("[warn] Could not find a deployment for the current commit.")
         return ""
 
     print(f"[info from the loop] Inspecting deployment {dep_id} ...")
-    cmd = ["vercel", "inspect", dep_id, "--logs", "--wait"]
+    # --wait returns as soon as the deployment is READY/ERROR/CANCELED.
+    cmd = [
+        VERCEL, "inspect", dep_id, "--logs", "--wait",
+        "--timeout", f"{CONFIG.deploy_wait_timeout_seconds}s",
+    ]
+
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=CONFIG.repo_path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=_VERCEL_ENV,
+        limit=1024 * 1024,
+    )
+    out_lines: collections.deque[str] = collections.deque(maxlen=LOG_TAIL_LINES)
+    err_lines: collections.deque[str] = collections.deque(maxlen=LOG_TAIL_LINES)
+    finished = False
+
+    def watch_for_end(line: str) -> None:
+        nonlocal finished
+        if finished:
+            return
+        lower = line.lower()
+        failed = any(marker in lower for marker in _BUILD_FAILED_MARKERS)
+        if not failed and not any(marker in lower for marker in _DEPLOY_DONE_MARKERS):
+            return
+        finished = True
+        if failed and on_build_failed:
+            on_build_failed("".join(out_lines))
+        if proc.returncode is None:
+            proc.terminate()
+
+    try:
+        await asyncio.gather(
+            _read_lines(proc.stdout, out_lines, watch_for_end),
+            _read_lines(proc.stderr, err_lines),
+        )
+        await proc.wait()
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
 
-    stdout, stderr, _ = run(cmd, cwd=REPO_PATH, check=False, env=env)
-    logs = stdout if stdout.strip() else stderr
-    if not logs.strip():
+    stdout = "".join(out_lines)
+    stderr = "".join(err_lines)
+    logs = stderr if is_blank(stdout) else stdout
+    if is_blank(logs):
         print("[warn] No logs returned from Vercel for this deployment.")
         return ""
 
@@ -267,76 +547,266 @@ def fetch_latest_build_logs() -> str:
     return logs
 
 
+def resolve_git_rev(rev: str) -> str:
+    """
+    Resolve a revision (e.g. "HEAD") to its full object hash.
+
+    Queries go to one persistent `git cat-file --batch-check` process, which
+    re-reads refs on every request, so the answer tracks new commits.
+    """
+    global _GIT_BATCH
+    if _GIT_BATCH is None or _GIT_BATCH.poll() is not None:
+        _GIT_BATCH = subprocess.Popen(
+            [GIT, "cat-file", "--batch-check"],
+            cwd=CONFIG.repo_path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            close_fds=False,
+        )
+    try:
+        _GIT_BATCH.stdin.write(f"{rev}\n")
+        _GIT_BATCH.stdin.flush()
+        line = _GIT_BATCH.stdout.readline()
+    except (BrokenPipeError, OSError):
+        line = ""
+    parts = line.split()
+    if len(parts) != 3:
+        raise RuntimeError(f"git cat-file could not resolve {rev!r}: {line.strip() or 'no output'}")
+    return parts[0]
+
+
 def get_current_commit_hash(short: bool = True) -> str:
     """Return the current HEAD commit hash (short or full)."""
-    if short:
-        cmd = ["git", "rev-parse", "--short=7", "HEAD"]
-    else:
-        cmd = ["git", "rev-parse", "HEAD"]
-    stdout, _, _ = run(cmd, cwd=REPO_PATH, check=True)
-    return stdout.strip()
+    cached = _HEAD_CACHE.get(short)
+    if cached:
+        return cached
+    full = resolve_git_rev("HEAD")
+    _HEAD_CACHE[False] = full
+    _HEAD_CACHE[True] = full[:7]
+    return _HEAD_CACHE[short]
+
+
+# The cloning step of a Vercel build log names the commit explicitly, e.g.
+# "Cloning github.com/org/repo (Branch: main, Commit: 1a2b3c4)".
+_COMMIT_LINE_RE = re.compile(r"\bCommit:\s*([0-9a-f]{7,40})\b", re.IGNORECASE)
+
+# Deployment ID -> commit hash named in its build log. A deployment's commit
+# never changes, so each candidate only has to be inspected once per run.
+_DEPLOYMENT_COMMITS: dict[str, str] = {}
+
+# A `vercel list` row: the first column is a deployment URL or a raw ID
+# (dpl_..., or 8+ alphanumerics containing a digit). Headers, the "Vercel
+# CLI" banner and box-drawing separators never match.
+_DEPLOYMENT_ROW_RE = re.compile(
+    r"^[ \t]*(?P<id>(?:https://|dpl_)\S*|\S*\.vercel\.app\S*|(?=[A-Za-z0-9]*\d)[A-Za-z0-9]{8,}(?!\S))"
+    r"(?P<rest>.*)$",
+    re.MULTILINE,
+)
+
+# Only the newest few `vercel list` rows can be the current build; inspect
+# that many of them concurrently instead of walking the whole listing.
+INSPECT_CANDIDATES = 8
+INSPECT_CONCURRENCY = 4
+
+
+def vercel_api_get(path: str, params: dict) -> dict:
+    """
+    GET a Vercel REST endpoint and return the decoded JSON body.
+
+    Reuses one HTTPS connection across calls, so repeat lookups skip the
+    TCP/TLS handshake and the Node startup of the CLI. Reconnects once if
+    the server dropped the idle connection. Raises RuntimeError on failure.
+    """
+    global _VERCEL_API_CONN
+    query = urllib.parse.urlencode({k: v for k, v in params.items() if v})
+    headers = {"Authorization": f"Bearer {CONFIG.vercel_token}"}
+    for attempt in (1, 2):
+        if _VERCEL_API_CONN is None:
+            _VERCEL_API_CONN = http.client.HTTPSConnection(CONFIG.vercel_api_host, timeout=30)
+        try:
+            _VERCEL_API_CONN.request("GET", f"{path}?{query}", headers=headers)
+            resp = _VERCEL_API_CONN.getresponse()
+            body = resp.read()
+        except (http.client.HTTPException, OSError) as e:
+            _VERCEL_API_CONN.close()
+            _VERCEL_API_CONN = None
+            if attempt == 2:
+                raise RuntimeError(f"Vercel API request {path} failed: {e}") from e
+            continue
+        if resp.status != 200:
+            raise RuntimeError(f"Vercel API {path} returned {resp.status}: {body[:500]!r}")
+        return json.loads(body)
+
+
+def _linked_project() -> tuple[str, str] | None:
+    """Return (projectId, teamId) from the repo's .vercel/project.json, if linked."""
+    try:
+        project = json.loads((CONFIG.repo_path / ".vercel" / "project.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    project_id = project.get("projectId")
+    if not project_id:
+        return None
+    org_id = project.get("orgId", "")
+    team_id = CONFIG.vercel_team_id or (org_id if org_id.startswith("team_") else "")
+    return project_id, team_id
+
+
+async def list_deployments_via_api(limit: int = 20, filters: dict | None = None) -> list[dict] | None:
+    """
+    Return the project's recent deployments from the Vercel REST API, or
+    None when the API can't be used (no VERCEL_TOKEN, repo not linked, or
+    the request failed) so the caller can fall back to the CLI.
+
+    `filters` are passed through as query params, e.g.
+    {"meta-githubCommitSha": sha} to let Vercel do the matching.
+    """
+    if not CONFIG.vercel_token:
+        return None
+    project = _linked_project()
+    if not project:
+        return None
+    project_id, team_id = project
+    try:
+        data = await asyncio.to_thread(
+            vercel_api_get,
+            "/v6/deployments",
+            {"projectId": project_id, "teamId": team_id, "limit": limit, **(filters or {})},
+        )
+    except (RuntimeError, ValueError) as e:
+        print(f"[warn] Vercel API lookup failed; falling back to the CLI: {e}")
+        return None
+    return data.get("deployments") or []
+
+
+async def latest_deployment_ready(commit_full: str) -> bool:
+    """
+    True if the newest deployment Vercel lists for this commit is READY.
+    One API call filtered by meta-githubCommitSha, limit=1; False whenever
+    the API can't answer, so the caller falls back to a full check.
+    """
+    deployments = await list_deployments_via_api(
+        limit=1, filters={"meta-githubCommitSha": commit_full}
+    )
+    if not deployments:
+        return False
+    dep = deployments[0]
+    return (dep.get("state") or dep.get("readyState")) == "READY"
 
 
-def get_deployment_id_for_current_commit() -> str | None:
+async def _deployment_commit_via_cli(dep_id: str) -> str | None:
+    """
+    Commit hash from the "Commit:" line of a deployment's build log, if any.
+
+    The log is streamed and `vercel inspect` is stopped as soon as that line
+    shows up; it comes from the clone step near the top of the log.
+    """
+    dep_commit = _DEPLOYMENT_COMMITS.get(dep_id)
+    if dep_commit is not None:
+        return dep_commit
+    print(f"[debug from the loop] Inspecting deployment {dep_id}...")
+    proc = await asyncio.create_subprocess_exec(
+        VERCEL, "inspect", dep_id, "--logs",
+        cwd=CONFIG.repo_path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        env=_VERCEL_ENV,
+        limit=1024 * 1024,
+    )
+    try:
+        async for raw in proc.stdout:
+            if dep_commit is not None:
+                continue  # draining what was buffered before terminate()
+            match = _COMMIT_LINE_RE.search(raw.decode("utf-8", errors="replace"))
+            if match:
+                dep_commit = _DEPLOYMENT_COMMITS[dep_id] = match.group(1).lower()
+                if proc.returncode is None:
+                    proc.terminate()
+        await proc.wait()
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    # No match: possibly queued before cloning; look again next time.
+    return dep_commit
+
+
+def _deployment_meta_commit(dep: dict) -> str:
+    """Commit SHA a git-triggered deployment was built from ("" if none)."""
+    meta = dep.get("meta") or {}
+    for key in ("githubCommitSha", "gitlabCommitSha", "bitbucketCommitSha"):
+        if meta.get(key):
+            return meta[key].lower()
+    return ""
+
+
+async def get_deployment_id_for_current_commit() -> str | None:
     """
     Find the Vercel deployment whose commit hash matches the current HEAD.
 
-    Works with older Vercel CLI (no --json, no --limit):
+    With VERCEL_TOKEN set and the repo linked, the REST API's deployment list
+    is matched on its git commit metadata. Otherwise, or when no deployment
+    carries commit metadata, this falls back to the CLI. That path works
+    with older Vercel CLI (no --json, no --limit):
 
     - Run `vercel list` in the linked project dir (uses .vercel/project.json).
-    - Parse deployment IDs from the first column of the table.
-    - For each ID, run `vercel inspect <id>` and search for the short commit hash.
+    - Parse deployment IDs from the first column of the table. A row that
+      already shows the short hash is taken as the match.
+    - Otherwise run `vercel inspect <id>` on the newest few IDs concurrently
+      and compare the "Commit:" line of each build log to HEAD. Matching that
+      line, not any occurrence of the short hash, avoids false positives from
+      unrelated hex strings.
     """
 
+    commit_full = get_current_commit_hash(short=False)
     commit_short = get_current_commit_hash(short=True)
     print(f"[info from the loop] Looking for deployment of commit {commit_short}...")
 
-    env = os.environ.copy()
-    if VERCEL_TOKEN:
-        env["VERCEL_AUTH_TOKEN"] = VERCEL_TOKEN
-    if VERCEL_TEAM_ID:
-        env["VERCEL_TEAM_ID"] = VERCEL_TEAM_ID
+    # Let Vercel filter by commit first; only a miss needs the wider scan,
+    # which also covers GitLab/Bitbucket metadata keys.
+    matches = await list_deployments_via_api(limit=1, filters={"meta-githubCommitSha": commit_full})
+    if matches and matches[0].get("uid"):
+        dep_id = matches[0]["uid"]
+        print(f"[info from the loop] Matched commit {commit_short} to deployment {dep_id} via the Vercel API")
+        return dep_id
+
+    deployments = await list_deployments_via_api() if matches is not None else None
+    if deployments:
+        commits = [(dep.get("uid"), _deployment_meta_commit(dep)) for dep in deployments]
+        for dep_id, dep_commit in commits:
+            if dep_id and dep_commit == commit_full.lower():
+                print(f"[info from the loop] Matched commit {commit_short} to deployment {dep_id} via the Vercel API")
+                return dep_id
+        if any(dep_commit for _, dep_commit in commits):
+            # Git-integrated project; the deployment just doesn't exist yet.
+            print(f"[warn] No deployment found for commit {commit_short} via the Vercel API.")
+            return None
 
     # 1) Get deployments in plain-text table form
-    cmd = ["vercel", "list"]  # no --json, no --limit
-    stdout, stderr, rc = run(cmd, cwd=REPO_PATH, check=False, env=env)
+    cmd = [VERCEL, "list"]  # no --json, no --limit
+    stdout, stderr, rc = await run_async(cmd, cwd=CONFIG.repo_path, check=False, env=_VERCEL_ENV)
 
-    if rc != 0 or not stdout.strip():
+    if rc != 0 or is_blank(stdout):
         print("[warn] `vercel list` failed or returned no data.")
-        if stderr.strip():
+        if not is_blank(stderr):
             print("[vercel list stderr]")
             print(stderr)
         return None
 
-    # 2) Parse deployment IDs / URLs from each non-header line.
+    # 2) Parse deployment IDs / URLs from the first column of each row.
     # Newer Vercel CLI prints the deployment URL as the first column (no raw IDs).
+    inline_commit = re.compile(rf"\b{re.escape(commit_short)}[0-9a-f]*\b", re.IGNORECASE)
     dep_ids: list[str] = []
-    for line in stdout.splitlines():
-        raw = line.rstrip()
-        stripped = raw.strip()
-        if not stripped:
-            continue
-        if stripped.startswith("Vercel CLI"):
-            continue
-        # Skip obvious headers / separators
-        lower = stripped.lower()
-        if lower.startswith("age ") or lower.startswith("deployment") or lower.startswith("id "):
-            continue
-        if set(stripped) <= {"─", "━", " ", "┌", "└", "┼", "│", "┐", "┘"}:
-            continue
-
-        parts = stripped.split()
-        if not parts:
-            continue
-
-        dep_id = parts[0]
-        is_url = ".vercel.app" in dep_id or dep_id.startswith("https://")
-        is_raw_id = (
-            dep_id.startswith("dpl_")
-            or (dep_id.isalnum() and len(dep_id) >= 8 and any(ch.isdigit() for ch in dep_id))
-        )
-        if is_url or is_raw_id:
-            dep_ids.append(dep_id)
+    for row in _DEPLOYMENT_ROW_RE.finditer(stdout):
+        dep_id = row.group("id")
+        if inline_commit.search(row.group("rest")):
+            # Newer CLIs print the commit in the listing; no inspect needed.
+            print(f"[info from the loop] Matched commit {commit_short} to deployment {dep_id} from `vercel list`")
+            return dep_id
+        dep_ids.append(dep_id)
 
     if not dep_ids:
         print("[warn] Could not parse any deployment IDs from `vercel list`.")
@@ -344,51 +814,93 @@ def get_deployment_id_for_current_commit() -> str | None:
 
     print(f"[info from the loop] Parsed {len(dep_ids)} deployment candidates from `vercel list`.")
 
-    # 3) For each candidate deployment, inspect it (with logs) and look for the commit hash
-    for dep_id in dep_ids:
-        print(f"[debug from the loop] Inspecting deployment {dep_id} for commit {commit_short}...")
-        insp_out, insp_err, _ = run(
-            ["vercel", "inspect", dep_id, "--logs"],
-            cwd=REPO_PATH,
-            check=False,
-            env=env,
-        )
-        combined = f"{insp_out}\n{insp_err}"
-        if commit_short in combined:
-            print(f"[info from the loop] Matched commit {commit_short} to deployment {dep_id}")
-            return dep_id
+    # 3) Inspect the newest candidates concurrently. Results are checked in
+    # listing order, so a redeploy of the same commit still resolves to the
+    # newest deployment; the rest are cancelled once a match is known.
+    candidates = dep_ids[:INSPECT_CANDIDATES]
+    limit = asyncio.Semaphore(INSPECT_CONCURRENCY)
+
+    async def inspect(dep_id: str) -> str | None:
+        async with limit:
+            return await _deployment_commit_via_cli(dep_id)
 
-    print(f"[warn] No deployment found for commit {commit_short} in {len(dep_ids)} candidates.")
+    tasks = [asyncio.create_task(inspect(dep_id)) for dep_id in candidates]
+    try:
+        for dep_id, task in zip(candidates, tasks):
+            dep_commit = await task
+            if dep_commit and commit_full.lower().startswith(dep_commit):
+                print(f"[info from the loop] Matched commit {commit_short} to deployment {dep_id}")
+                return dep_id
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    print(f"[warn] No deployment found for commit {commit_short} in {len(candidates)} candidates.")
     return None
 
+async def wait_for_deployment(timeout: float = CONFIG.deploy_wait_timeout_seconds) -> str | None:
+    """
+    Poll until Vercel has created a deployment for the current HEAD commit.
+
+    Backs off 1s, 2s, 4s, ... capped at 30s per attempt, so a fast build is
+    picked up quickly instead of always waiting SLEEP_AFTER_PUSH_SECONDS.
+    Returns the deployment ID, or None if none appeared before the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        attempt += 1
+        delay = min(2 ** (attempt - 1), 30)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"[warn] No deployment appeared for the new commit within {timeout:.0f}s.")
+            return None
+        print(f"[info from the loop] Waiting {min(delay, remaining):.0f}s for Vercel to pick up the new commit...")
+        await asyncio.sleep(min(delay, remaining))
+        dep_id = await get_deployment_id_for_current_commit()
+        if dep_id:
+            return dep_id
+
+
+# Typical failure hints
+_FAILURE_MARKERS = (
+    "error ",
+    "failed",
+    "build failed",
+    "exit code 1",
+    "command \"npm run build\" exited with 1",
+)
+# Some positive indicators – you can tune these
+_SUCCESS_MARKERS = (
+    "deployment completed",
+    "build completed",
+    "ready! deployed to",
+)
+# Both marker sets in one case-insensitive alternation, so the log is
+# scanned once and never copied into a lowercased string.
+_MARKER_RE = re.compile(
+    "(?P<fail>" + "|".join(map(re.escape, _FAILURE_MARKERS)) + ")"
+    "|(?P<ok>" + "|".join(map(re.escape, _SUCCESS_MARKERS)) + ")",
+    re.IGNORECASE,
+)
+
+
 def build_looks_successful(logs: str) -> bool:
     """
     Naive heuristic to decide whether the build is 'clean enough'.
     Adjust this to match your project’s real success markers.
     """
-    text = logs.lower()
-
-    # Typical failure hints
-    possible_failure_markers = [
-        "error ",
-        "failed",
-        "build failed",
-        "exit code 1",
-        "command \"npm run build\" exited with 1",
-    ]
-    if any(marker in text for marker in possible_failure_markers):
-        return False
-
-    # Some positive indicators – you can tune these
-    possible_success_markers = [
-        "deployment completed",
-        "build completed",
-        "ready! deployed to",
-    ]
-    return any(marker in text for marker in possible_success_markers)
+    # Any failure marker wins, wherever it appears.
+    seen_success = False
+    for match in _MARKER_RE.finditer(logs):
+        if match.lastgroup == "fail":
+            return False
+        seen_success = True
+    return seen_success
 
 
-def run_codex_on_logs(logs: str) -> bool:
+async def run_codex_on_logs(logs: str) -> bool:
     """
     Send logs to Codex via stdin. Returns:
       True  -> Codex did apply changes (or thinks it did)
@@ -396,26 +908,27 @@ def run_codex_on_logs(logs: str) -> bool:
 
     You *must* adapt this to however your local Codex tool behaves.
     """
+    global _PATHS_TO_STAGE
+    _PATHS_TO_STAGE = None
     print("\n[step] Running Codex with latest build logs...")
+    if is_blank(logs):
+        print("[info from the loop] No logs provided to Codex. Skipping.")
+        return False
+
     # Persist latest logs to a file Codex can read (many recipes look for this).
-    logs_file = REPO_PATH / "dev_debug_logs.md"
+    logs_file = CONFIG.repo_path / "dev_debug_logs.md"
+    header = f"# Vercel build logs\n\nFetched: {time.strftime('%Y-%m-%d %H:%M:%S %Z')}\n\n```\n"
     try:
-        logs_file.write_text(
-            f"# Vercel build logs\n\nFetched: {time.strftime('%Y-%m-%d %H:%M:%S %Z')}\n\n```\n{logs}\n```\n",
-            encoding="utf-8",
+        logs_file.write_bytes(
+            header.encode("utf-8") + logs.encode("utf-8", errors="replace") + b"\n```\n"
         )
         print(f"[info] Wrote logs to {logs_file} for Codex context.")
     except Exception as e:
         print(f"[warn] Could not write logs file {logs_file}: {e}")
 
-    # Check if there were already changes before Codex runs
-    had_changes_before = git_workdir_has_changes()
+    env = _CODEX_ENV
 
-    env = os.environ.copy()
-    env["PYTHONUNBUFFERED"] = "1"
-    env.setdefault("CODEX_LOG_LEVEL", "info")
-
-    if CODEX_USE_EXEC:
+    if CONFIG.codex_use_exec:
         # Non-interactive mode: use codex exec with a task payload that includes logs.
         task = (
             "You are Codex running in an autofix loop for a Vercel deployment.\n"
@@ -426,21 +939,23 @@ def run_codex_on_logs(logs: str) -> bool:
             "- If lockfile mismatches are indicated, refresh the lockfile accordingly.\n"
             "\n"
             "Vercel logs:\n"
-            f"{logs}\n"
+            f"{codex_log_tail(logs)}\n"
         )
         cmd = [
-            "codex",
+            CODEX,
             "exec",
             "--full-auto",
             "--sandbox",
             "workspace-write",
-            task,
+            "-",  # read the task from stdin; logs can exceed ARG_MAX as argv
         ]
-        stdout, stderr, returncode = run(cmd, cwd=REPO_PATH, check=False, env=env)
+        stdout, stderr, returncode = await run_async(
+            cmd, cwd=CONFIG.repo_path, input_text=task, check=False, env=env
+        )
 
         print("[codex stdout]")
         print(stdout)
-        if stderr.strip():
+        if not is_blank(stderr):
             print("\n[codex stderr]")
             print(stderr)
 
@@ -448,8 +963,10 @@ def run_codex_on_logs(logs: str) -> bool:
             print(f"[warn] Codex exec exited with non-zero status ({returncode}).")
             return False
 
-        has_changes_after = git_workdir_has_changes()
-        if not has_changes_after and not had_changes_before:
+        # No "before" snapshot needed: pre-existing edits still show up here,
+        # and if Codex reverted them there's nothing left to commit anyway.
+        has_changes, _PATHS_TO_STAGE = git_dirty_paths()
+        if not has_changes:
             print("[info] Codex exec made no file changes.")
             return False
 
@@ -457,21 +974,21 @@ def run_codex_on_logs(logs: str) -> bool:
         return True
 
     # --- Interactive path (legacy) ---
-    def run_once(cmd: list[str], label: str):
+    async def run_once(cmd: tuple[str, ...], label: str):
         print(f"[debug from the loop] Running Codex command ({label}): {' '.join(cmd)}")
-        return run(
+        return await run_async(
             cmd,
-            cwd=REPO_PATH,
-            input_text=logs,
+            cwd=CONFIG.repo_path,
+            input_text=codex_log_tail(logs),
             check=False,  # we handle non-zero ourselves
             env=env,
         )
 
-    stdout, stderr, returncode = run_once(CODEX_CMD, "plain")
+    stdout, stderr, returncode = await run_once(CONFIG.codex_cmd, "plain")
 
     print("[codex stdout]")
     print(stdout)
-    if stderr.strip():
+    if not is_blank(stderr):
         print("\n[codex stderr]")
         print(stderr)
 
@@ -483,18 +1000,20 @@ def run_codex_on_logs(logs: str) -> bool:
     if returncode != 0 and needs_tty:
         print("[info from the loop] Codex requires a TTY; retrying via in-process pseudo-tty...")
         # Ensure a sensible TERM so cursor probes don't explode
-        env["TERM"] = env.get("TERM", "xterm-256color")
-        stdout, stderr, returncode = run_with_pty(
-            CODEX_CMD,
-            cwd=REPO_PATH,
-            input_text=logs,
+        env = {**env, "TERM": env.get("TERM", "xterm-256color")}
+        # run_with_pty drives its own selector loop; keep it off the event loop.
+        stdout, stderr, returncode = await asyncio.to_thread(
+            run_with_pty,
+            CONFIG.codex_cmd,
+            cwd=CONFIG.repo_path,
+            input_text=codex_log_tail(logs),
             env=env,
             stream_to_stdout=True,
             timeout_seconds=180.0,
         )
         print("[codex stdout]")
         print(stdout)
-        if stderr.strip():
+        if not is_blank(stderr):
             print("\n[codex stderr]")
             print(stderr)
         combined = (stdout + stderr).lower()
@@ -513,20 +1032,35 @@ def run_codex_on_logs(logs: str) -> bool:
     return True
 
 
-def git_commit_and_push() -> bool:
+async def git_commit_and_push() -> bool:
     """
     git add/commit/push. Returns True if something was pushed, False if nothing changed.
     """
+    global _PATHS_TO_STAGE
     print("\n[step] Git add/commit/push...")
 
-    # Stage everything
-    run(["git", "add", "-A"], cwd=REPO_PATH)
+    paths, _PATHS_TO_STAGE = _PATHS_TO_STAGE, None
+    if paths is None:
+        # Stage everything
+        await run_quiet([GIT, "add", "-A"], cwd=CONFIG.repo_path)
+    elif paths:
+        # Stage just what `git status` reported after Codex ran. Those paths
+        # are relative to the repo root, but pathspecs resolve against the
+        # cwd, which differs when REPO_PATH is an app dir inside a monorepo.
+        # `top` anchors them at the root; `literal` keeps glob characters in
+        # file names from being expanded.
+        await run_quiet(
+            [GIT, "add", "-A", "--pathspec-from-file=-", "--pathspec-file-nul"],
+            cwd=CONFIG.repo_path,
+            input_text="\0".join(":(top,literal)" + path for path in paths),
+            errors="surrogateescape",
+        )
 
     # Commit; if nothing to commit, git will exit non-zero
     commit_msg = "chore: auto-fix by codex based on Vercel build logs"
-    stdout, stderr, returncode = run(
-        ["git", "commit", "-m", commit_msg],
-        cwd=REPO_PATH,
+    stdout, stderr, returncode = await run_async(
+        [GIT, "commit", "-m", commit_msg],
+        cwd=CONFIG.repo_path,
         check=False,
     )
 
@@ -538,140 +1072,115 @@ def git_commit_and_push() -> bool:
             f"git commit failed unexpectedly:\nSTDOUT:\n{stdout}\nSTDERR:\n{stderr}"
         )
 
+    # HEAD moved; drop the cached hash.
+    _HEAD_CACHE.clear()
+
     print("[info from the loop] Commit created:")
     print(stdout)
 
-    # Push
-    stdout, stderr, returncode = run(
-        ["git", "push", GIT_REMOTE, GIT_BRANCH],
-        cwd=REPO_PATH,
-        check=False,
-    )
-    if returncode != 0:
-        raise RuntimeError(
-            f"git push failed:\nSTDOUT:\n{stdout}\nSTDERR:\n{stderr}"
-        )
+    # Push; git reports progress and errors on stderr only
+    await run_quiet([GIT, "push", CONFIG.git_remote, CONFIG.git_branch], cwd=CONFIG.repo_path)
 
     print("[info from the loop] git push completed.")
     return True
 
-def apply_codex_fixes(logs: str) -> bool:
-    """
-    Use Codex CLI (`codex exec`) to try to fix the build based on Vercel logs.
-
-    Strategy:
-    - Build a task message that includes the logs.
-    - Run `codex exec` with --full-auto and a sandbox mode that allows file edits.
-    - Compare git diff before/after to see if any files changed.
-    """
-    print("\n[step] Running Codex (codex exec) to apply fixes...")
-
-    if not logs.strip():
-        print("[info from the loop] No logs provided to Codex. Skipping.")
-        return False
-
-    # Check if there were already changes before Codex runs
-    had_changes_before = git_workdir_has_changes()
-
-    # Build the task string for Codex CLI
-    task = (
-        "You are Codex running in a CI autofix loop for a Vercel deployment.\n\n"
-        "The build or deployment has failed. Your goal:\n"
-        "1. Read the build logs.\n"
-        "2. Identify the root cause of the failure.\n"
-        "3. Modify files in this Git repository to fix the issue.\n"
-        "4. DO NOT commit; just edit files. A separate step will commit and push.\n\n"
-        "Here are the Vercel logs:\n\n"
-        f"{logs}\n"
-    )
-
-    # Environment for Codex; it can reuse OpenAI CLI auth or you can set CODEX_API_KEY
-    env = os.environ.copy()
-    # Example: if you want to override per-run, set CODEX_API_KEY in .env
-    # env["CODEX_API_KEY"] = os.getenv("CODEX_API_KEY", env.get("CODEX_API_KEY", ""))
-
-    cmd = [
-        "codex",
-        "exec",
-        "--full-auto",                 # allow Codex to edit files
-        "--sandbox",
-        "workspace-write",             # allow writes inside repo, but no arbitrary network
-        task,
-    ]
-
-    stdout, stderr, returncode = run(cmd, cwd=REPO_PATH, check=False, env=env)
-
-    # Stream Codex info for debugging
-    print("\n[codex stdout - final message]")
-    print(stdout)
-    if stderr.strip():
-        print("\n[codex stderr - activity log]")
-        print(stderr)
-
-    if returncode != 0:
-        print(f"[warn] Codex exited with non-zero status ({returncode}). "
-              f"Treating as 'no changes'.")
-        return False
+def load_loop_state() -> dict:
+    """Return the saved loop state, or {} if there is none."""
+    try:
+        return json.loads(_STATE_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
 
-    # Check if Codex actually changed anything
-    has_changes_after = git_workdir_has_changes()
 
-    if not has_changes_after and not had_changes_before:
-        print("[info from the loop] Codex made no file changes.")
-        return False
+def save_loop_state(**updates) -> None:
+    """
+    Merge `updates` into the saved loop state; skipped when .git isn't a
+    directory (e.g. worktrees).
+    """
+    if not _STATE_FILE.parent.is_dir():
+        return
+    try:
+        _STATE_FILE.write_text(json.dumps({**load_loop_state(), **updates}), encoding="utf-8")
+    except OSError as e:
+        print(f"[warn] Could not save loop state to {_STATE_FILE}: {e}")
 
-    print("[info from the loop] Codex appears to have modified the repo.")
-    return True
 
 # =========================
 # MAIN LOOP
 # =========================
 
-def main():
+async def main():
     print("[start] Vercel ↔ Codex auto-fix loop")
-    print(f"Repo:   {REPO_PATH}")
-    print(f"Branch: {GIT_BRANCH}")
-    print(f"URL:    {PROD_URL}")
-
-    for i in range(1, MAX_ITERATIONS + 1):
+    print(f"Repo:   {CONFIG.repo_path}")
+    print(f"Branch: {CONFIG.git_branch}")
+    print(f"URL:    {CONFIG.prod_url}")
+
+    # Skip the whole loop if HEAD is the commit a previous run saw succeed
+    # and Vercel's newest deployment of it is still READY. A redeploy of the
+    # same SHA can fail (env var change, dependency drift), so the saved
+    # state alone isn't trusted.
+    head = get_current_commit_hash(short=False)
+    if load_loop_state().get("last_green_sha") == head and await latest_deployment_ready(head):
+        print(f"[info from the loop] Commit {head[:7]} already built successfully; its latest deployment is READY.")
+        print("[done] Nothing to do.")
+        return
+
+    dep_id = None
+    for i in range(1, CONFIG.max_iterations + 1):
         print(f"\n==============================")
-        print(f"Iteration {i}/{MAX_ITERATIONS}")
+        print(f"Iteration {i}/{CONFIG.max_iterations}")
         print(f"==============================")
 
-        # 1. Fetch current build logs
-        logs = fetch_latest_build_logs()
-        if not logs.strip():
+        # 1. Fetch current build logs. If the build is seen failing while logs
+        #    are still streaming, Codex starts right away instead of waiting
+        #    for Vercel to finish.
+        speculative_fix: asyncio.Task | None = None
+
+        def start_codex_early(partial_logs: str) -> None:
+            nonlocal speculative_fix
+            print("[info from the loop] Build failure seen in streamed logs; starting Codex early...")
+            speculative_fix = asyncio.create_task(run_codex_on_logs(partial_logs))
+
+        logs = await fetch_latest_build_logs(dep_id, on_build_failed=start_codex_early)
+        dep_id = None
+        if is_blank(logs):
             print("[warn] No logs found. Sleeping and retrying...")
-            time.sleep(SLEEP_AFTER_PUSH_SECONDS)
+            await asyncio.sleep(CONFIG.sleep_after_push_seconds)
             continue
 
         # 2. If build is already clean AND we’ve looped at least once, we can stop
         if build_looks_successful(logs):
+            save_loop_state(last_green_sha=get_current_commit_hash(short=False))
             print("[info from the loop] Build looks successful 🎉")
             print("[done] Stopping loop.")
             return
 
-        # 3. Ask Codex to fix issues based on the logs
-        changed = run_codex_on_logs(logs)
+        # 3. Ask Codex to fix issues based on the logs. A speculative run only
+        #    starts on a failure marker in stdout, and failure markers take
+        #    precedence in build_looks_successful, so it is never wasted.
+        if speculative_fix is not None:
+            changed = await speculative_fix
+        else:
+            changed = await run_codex_on_logs(logs)
         if not changed:
             print("[info from the loop] Codex has no further changes. Stopping loop.")
             return
 
         # 4. Commit & push changes (this triggers a new Vercel deployment)
-        pushed = git_commit_and_push()
+        pushed = await git_commit_and_push()
         if not pushed:
             print("[info from the loop] No code changes actually pushed. Stopping loop.")
             return
 
-        # 5. Give Vercel time to build the new commit
-        print(f"[info from the loop] Sleeping {SLEEP_AFTER_PUSH_SECONDS}s while Vercel builds...")
-        time.sleep(SLEEP_AFTER_PUSH_SECONDS)
+        # 5. Wait for Vercel to start building the new commit; the next
+        #    iteration's `vercel inspect --wait` blocks until it finishes.
+        dep_id = await wait_for_deployment()
 
-    print(f"[stop] Reached MAX_ITERATIONS={MAX_ITERATIONS}. Exiting.")
+    print(f"[stop] Reached MAX_ITERATIONS={CONFIG.max_iterations}. Exiting.")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
 
 # cd /path/to/your/repo
 # python /abs_path_to/vercel_codex_loop.py
@@ -1,11 +1,15 @@
+import functools
+import hashlib
 import subprocess
 import time
 from pathlib import Path
 import os
-import shutil
-import select
-import pty
+import shlex
+import re
 import sys
+import tempfile
+import threading
+import types
 from dotenv import load_dotenv
 import json
 
@@ -16,6 +20,8 @@ load_dotenv()  # Loads .env from repo root
 # =========================
 
 REPO_PATH = Path(os.getenv("REPO_PATH")).resolve()
+# Prefix for git commands. -C points git at the repo, so callers don't pass cwd.
+GIT = ["git", "-C", str(REPO_PATH)]
 PROD_URL = os.getenv("PROD_URL")
 
 GIT_REMOTE = os.getenv("GIT_REMOTE", "origin")
@@ -33,6 +39,44 @@ LLM_API_KEY = os.getenv("LLM_API_KEY")
 LLM_BASE_URL = os.getenv("LLM_BASE_URL")
 OPENHANDS_MAX_TURNS = int(os.getenv("OPENHANDS_MAX_TURNS", "8"))
 
+# Upper bounds for subprocess calls, so a hung CLI can't stall the loop.
+DEPLOY_WAIT_TIMEOUT_SECONDS = int(os.getenv("DEPLOY_WAIT_TIMEOUT_SECONDS", 600))
+GIT_TIMEOUT_SECONDS = 30
+GIT_PUSH_TIMEOUT_SECONDS = 120
+VERCEL_LIST_TIMEOUT_SECONDS = 60
+VERCEL_INSPECT_TIMEOUT_SECONDS = 180
+
+# When the metadata filter misses, only the newest few `vercel list` rows can
+# be the current build; inspect that many of them, a few at a time.
+INSPECT_CANDIDATES = 8
+INSPECT_WORKERS = 4
+
+# Environment for `vercel` subprocesses, built once instead of per call.
+# Treat as read-only; subprocesses get their own copy anyway.
+_VERCEL_ENV = {
+    **os.environ,
+    **({"VERCEL_AUTH_TOKEN": VERCEL_TOKEN} if VERCEL_TOKEN else {}),
+    **({"VERCEL_TEAM_ID": VERCEL_TEAM_ID} if VERCEL_TEAM_ID else {}),
+}
+
+# JSON state for this loop; today only `last_green_sha`, which lets main()
+# confirm an unchanged HEAD with one filtered `vercel list`. It sits under
+# .git so git_commit_and_push's `git add -A` can't pick it up.
+_STATE_FILE = REPO_PATH / ".git" / "vercel_openhands_loop.json"
+
+# Digest of the logs last written to dev_debug_logs.md. Identical logs skip
+# the rewrite, so file watchers don't re-index an unchanged file.
+_LOGS_FILE_HASH: bytes | None = None
+
+# The LLM client and agent are built on the first OpenHands run and reused after
+# that, so later iterations skip SDK setup and keep the client's connections.
+# Each run still gets a fresh Conversation.
+_LLM = None
+_AGENT = None
+
+# OpenHands SDK classes, imported on first use by _load_sdk().
+_sdk: types.SimpleNamespace | None = None
+
 # =========================
 # HELPER FUNCTIONS
 # =========================
@@ -42,40 +86,77 @@ def git_workdir_has_changes() -> bool:
     """
     Return True if there are unstaged or staged changes in the repo.
     """
-    result = subprocess.run(
-        ["git", "diff", "--quiet"],
-        cwd=REPO_PATH,
-        text=True,
-    )
-    if result.returncode != 0:
-        return True
-
-    result = subprocess.run(
-        ["git", "diff", "--cached", "--quiet"],
-        cwd=REPO_PATH,
-        text=True,
-    )
+    # `git diff --quiet HEAD` compares HEAD against the worktree and index
+    # together and answers through the exit code alone, so no output is
+    # captured. Untracked files are ignored, so dev_debug_logs.md doesn't count.
+    cmd = GIT + ["diff", "--quiet", "HEAD"]
+    try:
+        result = subprocess.run(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=GIT_TIMEOUT_SECONDS,
+        )
+    except subprocess.TimeoutExpired as e:
+        raise CommandTimeout(f"Command timed out after {GIT_TIMEOUT_SECONDS}s: {shlex.join(cmd)}", "", "") from e
     return result.returncode != 0
 
 
-def run(cmd, cwd=None, input_text=None, check=True, env=None, encoding="utf-8", errors="replace"):
+class CommandTimeout(RuntimeError):
+    """Raised by run() when a command outlives its timeout and is killed."""
+
+    def __init__(self, message: str, stdout: str, stderr: str):
+        super().__init__(message)
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def run(
+    cmd: list[str],
+    cwd=None,
+    input_text=None,
+    check=True,
+    env=None,
+    encoding="utf-8",
+    errors="replace",
+    timeout: float | None = None,
+):
     """
     Run a shell command and return stdout as text.
     Raises RuntimeError on non-zero exit code if check=True.
+
+    A command still running after `timeout` seconds is killed and
+    CommandTimeout is raised, whatever `check` says; it carries the output
+    captured so far.
     """
-    result = subprocess.run(
-        cmd,
-        cwd=cwd,
-        input=input_text,
-        text=True,
-        capture_output=True,
-        env=env,
-        encoding=encoding,
-        errors=errors,
-    )
+    try:
+        result = subprocess.run(
+            cmd,
+            cwd=cwd,
+            input=input_text,
+            text=True,
+            capture_output=True,
+            env=env,
+            encoding=encoding,
+            errors=errors,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired as e:
+        # On POSIX the partial output comes back as bytes even in text mode.
+        stdout, stderr = (
+            out.decode(encoding, errors) if isinstance(out, bytes) else (out or "")
+            for out in (e.stdout, e.stderr)
+        )
+        raise CommandTimeout(
+            f"Command timed out after {timeout}s: {shlex.join(cmd)}\n"
+            f"STDOUT:\n{stdout}\n"
+            f"STDERR:\n{stderr}",
+            stdout,
+            stderr,
+        ) from e
     if check and result.returncode != 0:
         raise RuntimeError(
-            f"Command failed: {' '.join(cmd)}\n"
+            f"Command failed: {shlex.join(cmd)}\n"
             f"Exit code: {result.returncode}\n"
             f"STDOUT:\n{result.stdout}\n"
             f"STDERR:\n{result.stderr}"
@@ -83,6 +164,10 @@ def run(cmd, cwd=None, input_text=None, check=True, env=None, encoding="utf-8",
     return result.stdout, result.stderr, result.returncode
 
 
+# Read PTY output in large blocks; chatty agents produce megabytes.
+PTY_CHUNK = 64 * 1024
+
+
 def run_with_pty(
     cmd,
     cwd=None,
@@ -100,6 +185,10 @@ def run_with_pty(
 
     Returns (stdout_and_stderr, "", returncode).
     """
+    # Imported here: most runs never need a PTY.
+    import pty
+    import selectors
+
     master_fd, slave_fd = pty.openpty()
     try:
         proc = subprocess.Popen(
@@ -114,7 +203,7 @@ def run_with_pty(
     finally:
         os.close(slave_fd)
 
-    output = bytearray()
+    chunks: list[bytes] = []
     start = time.time()
     last_output = start
     last_heartbeat = start
@@ -132,6 +221,14 @@ def run_with_pty(
         except OSError:
             pass
 
+    # Non-blocking from here on, so each wake can drain everything buffered.
+    # The selector registers the fd once instead of rebuilding an fd set
+    # on every select() call.
+    os.set_blocking(master_fd, False)
+    sel = selectors.DefaultSelector()
+    sel.register(master_fd, selectors.EVENT_READ)
+    eof = False
+
     while True:
         now = time.time()
         if timeout_deadline and now > timeout_deadline and not timed_out:
@@ -144,48 +241,68 @@ def run_with_pty(
             print("[warn] PTY process did not exit; killing...", flush=True)
             proc.kill()
 
-        ready, _, _ = select.select([master_fd], [], [], 0.1)
-        if master_fd in ready:
-            try:
-                chunk = os.read(master_fd, 1024)
-            except OSError:
-                break
-            if not chunk:
-                break
-            if b"\x1b[6n" in chunk:
-                try:
-                    os.write(master_fd, b"\x1b[1;1R")
-                except OSError:
-                    pass
-                chunk = chunk.replace(b"\x1b[6n", b"")
-            output.extend(chunk)
-            if stream_to_stdout and chunk:
-                try:
-                    sys.stdout.buffer.write(chunk)
-                    sys.stdout.flush()
-                except Exception:
-                    pass
-            if chunk:
-                last_output = now
-            if auto_yes and b"Would you like to run the following command?" in chunk:
-                try:
-                    os.write(master_fd, b"y\n")
-                except OSError:
-                    pass
-            if auto_yes and b"Press enter to confirm" in chunk:
+        # Sleep until the next timer is due instead of waking every 100ms.
+        # The 1s cap bounds how late a child exit is noticed when the PTY
+        # stays open (e.g. a grandchild still holds it).
+        deadlines = [now + 1.0, max(last_output, last_heartbeat) + 10]
+        if timeout_deadline and not timed_out:
+            deadlines.append(timeout_deadline)
+        if timed_out and not killed:
+            deadlines.append(terminate_at + 3.0)
+        if nudge_after_silence:
+            deadlines.append(last_output + nudge_after_silence)
+        ready = sel.select(max(0.0, min(deadlines) - now))
+        now = time.time()
+        if ready:
+            while True:
                 try:
-                    os.write(master_fd, b"\n")
+                    chunk = os.read(master_fd, PTY_CHUNK)
+                except BlockingIOError:
+                    break  # drained for now
                 except OSError:
-                    pass
+                    eof = True
+                    break
+                if not chunk:
+                    eof = True
+                    break
+                if b"\x1b[6n" in chunk:
+                    try:
+                        os.write(master_fd, b"\x1b[1;1R")
+                    except OSError:
+                        pass
+                    chunk = chunk.replace(b"\x1b[6n", b"")
+                chunks.append(chunk)
+                if stream_to_stdout and chunk:
+                    try:
+                        sys.stdout.buffer.write(chunk)
+                        sys.stdout.flush()
+                    except Exception:
+                        pass
+                if chunk:
+                    last_output = now
+                if auto_yes and b"Would you like to run the following command?" in chunk:
+                    try:
+                        os.write(master_fd, b"y\n")
+                    except OSError:
+                        pass
+                if auto_yes and b"Press enter to confirm" in chunk:
+                    try:
+                        os.write(master_fd, b"\n")
+                    except OSError:
+                        pass
+            if eof:
+                break
 
         if (now - last_output) > 10 and (now - last_heartbeat) > 10:
             print("[info from the loop] PTY command still running (no new output)...", flush=True)
             last_heartbeat = now
 
         if nudge_after_silence and (now - last_output) > nudge_after_silence:
+            # Reset the silence timer even if the write fails, so a dead PTY
+            # doesn't turn this deadline into a busy loop.
+            last_output = now
             try:
                 os.write(master_fd, b"\n")
-                last_output = now
                 print("[debug from the loop] Sent newline to nudge interactive prompt.", flush=True)
             except OSError:
                 pass
@@ -194,16 +311,15 @@ def run_with_pty(
             break
 
     while True:
-        ready, _, _ = select.select([master_fd], [], [], 0.1)
-        if master_fd not in ready:
+        if not sel.select(0.1):
             break
         try:
-            chunk = os.read(master_fd, 1024)
+            chunk = os.read(master_fd, PTY_CHUNK)
         except OSError:
             break
         if not chunk:
             break
-        output.extend(chunk)
+        chunks.append(chunk)
         if stream_to_stdout and chunk:
             try:
                 sys.stdout.buffer.write(chunk)
@@ -211,6 +327,7 @@ def run_with_pty(
             except Exception:
                 pass
 
+    sel.close()
     try:
         os.close(master_fd)
     except OSError:
@@ -223,7 +340,7 @@ def run_with_pty(
             rc = proc.wait()
     else:
         rc = proc.wait()
-    text_out = output.decode("utf-8", errors="replace")
+    text_out = b"".join(chunks).decode("utf-8", errors="replace")
     return text_out, "", rc
 
 
@@ -231,12 +348,6 @@ def fetch_latest_build_logs() -> str:
     """Fetch logs for the deployment that corresponds to the current HEAD commit."""
     print("\n[step] Fetching Vercel build logs for current commit...")
 
-    env = os.environ.copy()
-    if VERCEL_TOKEN:
-        env["VERCEL_AUTH_TOKEN"] = VERCEL_TOKEN
-    if VERCEL_TEAM_ID:
-        env["VERCEL_TEAM_ID"] = VERCEL_TEAM_ID
-
     dep_id = get_deployment_id_for_current_commit()
     if not dep_id:
         print("[warn] Could not find a deployment for the current commit.")
@@ -245,7 +356,15 @@ def fetch_latest_build_logs() -> str:
     print(f"[info from the loop] Inspecting deployment {dep_id} ...")
     cmd = ["vercel", "inspect", dep_id, "--logs", "--wait"]
 
-    stdout, stderr, _ = run(cmd, cwd=REPO_PATH, check=False, env=env)
+    try:
+        stdout, stderr, _ = run(
+            cmd, cwd=REPO_PATH, check=False, env=_VERCEL_ENV, timeout=DEPLOY_WAIT_TIMEOUT_SECONDS
+        )
+    except CommandTimeout:
+        # Timed out in --wait: the build is still running, so these logs
+        # are partial and say nothing about its outcome.
+        print(f"[warn] Deployment {dep_id} did not finish within {DEPLOY_WAIT_TIMEOUT_SECONDS}s.")
+        return ""
     logs = stdout if stdout.strip() else stderr
     if not logs.strip():
         print("[warn] No logs returned from Vercel for this deployment.")
@@ -256,38 +375,196 @@ def fetch_latest_build_logs() -> str:
     return logs
 
 
-def get_current_commit_hash(short: bool = True) -> str:
-    """Return the current HEAD commit hash (short or full)."""
-    if short:
-        cmd = ["git", "rev-parse", "--short=7", "HEAD"]
-    else:
-        cmd = ["git", "rev-parse", "HEAD"]
-    stdout, _, _ = run(cmd, cwd=REPO_PATH, check=True)
+@functools.lru_cache(maxsize=1)
+def _head_sha() -> str:
+    """
+    Return the full HEAD commit hash.
+
+    Cached: HEAD only moves when git_commit_and_push commits, which clears
+    the cache.
+    """
+    stdout, _, _ = run(GIT + ["rev-parse", "HEAD"], check=True, timeout=GIT_TIMEOUT_SECONDS)
     return stdout.strip()
 
 
+def get_current_commit_hash(short: bool = True) -> str:
+    """
+    Return the current HEAD commit hash (short or full).
+    Both forms come from one `git rev-parse HEAD`; short is its first 7 chars.
+    """
+    full = _head_sha()
+    return full[:7] if short else full
+
+
+# Deployment found for each commit hash. A commit's deployment doesn't
+# change, so retries for the same HEAD skip the Vercel lookup entirely.
+_DEPLOYMENT_BY_COMMIT: dict[str, str] = {}
+
+# (deployment ID, short commit hash) pairs whose full inspect log didn't
+# mention the commit, so later fallback walks don't inspect them again.
+_DEPLOYMENT_NOT_FOR_COMMIT: set[tuple[str, str]] = set()
+
+
+# A `vercel list` row: the first column is a deployment URL or a raw ID
+# (dpl_..., or 8+ alphanumerics containing a digit). Headers, the "Vercel
+# CLI" banner and box-drawing separators never match.
+_DEPLOYMENT_ROW_RE = re.compile(
+    r"^[ \t]*((?:https://|dpl_)\S*|\S*\.vercel\.app\S*|(?=[A-Za-z0-9]*\d)[A-Za-z0-9]{8,}(?!\S))",
+    re.MULTILINE,
+)
+
+
+def parse_deployment_ids(stdout: str) -> list[str]:
+    """Parse deployment IDs / URLs from the first column of a `vercel list` table."""
+    return _DEPLOYMENT_ROW_RE.findall(stdout)
+
+
+def latest_deployment_ready(commit_full: str) -> bool:
+    """
+    True if the newest deployment `vercel list -m githubCommitSha=<sha>`
+    shows for this commit has status Ready. False when the filter is
+    unsupported or lists nothing, so the caller falls back to a full check.
+    """
+    try:
+        stdout, _, rc = run(
+            ["vercel", "list", "-m", f"githubCommitSha={commit_full}"],
+            cwd=REPO_PATH,
+            check=False,
+            env=_VERCEL_ENV,
+            timeout=VERCEL_LIST_TIMEOUT_SECONDS,
+        )
+    except CommandTimeout as e:
+        print(f"[warn] {e.args[0].splitlines()[0]}")
+        return False
+    match = _DEPLOYMENT_ROW_RE.search(stdout) if rc == 0 else None
+    if not match:
+        return False
+    # The rest of the row holds the status column, e.g. "● Ready".
+    row_rest = stdout[match.end():].split("\n", 1)[0]
+    return re.search(r"\bReady\b", row_rest) is not None
+
+
+def inspect_has_commit(
+    dep_id: str,
+    commit_short: str,
+    env,
+    stop: threading.Event | None = None,
+    running: dict[str, subprocess.Popen] | None = None,
+    lock: "threading.Lock | None" = None,
+) -> bool:
+    """
+    Stream `vercel inspect <id> --logs` and report whether the short commit
+    hash shows up, stopping the CLI at the first hit instead of downloading
+    the rest of the build log. A log read to the end without a hit is
+    remembered in _DEPLOYMENT_NOT_FOR_COMMIT.
+
+    For concurrent callers: the CLI is registered in `running` under `lock`,
+    and not started once `stop` is set, so whoever sets `stop` (holding
+    `lock`) can kill every inspect still in flight.
+    """
+    if (dep_id, commit_short) in _DEPLOYMENT_NOT_FOR_COMMIT:
+        return False
+    lock = lock or threading.Lock()
+    with lock:
+        if stop is not None and stop.is_set():
+            return False
+        proc = subprocess.Popen(
+            ["vercel", "inspect", dep_id, "--logs"],
+            cwd=REPO_PATH,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+        )
+        if running is not None:
+            running[dep_id] = proc
+    # A streamed read has no timeout of its own; kill the CLI if it hangs.
+    watchdog = threading.Timer(VERCEL_INSPECT_TIMEOUT_SECONDS, proc.kill)
+    watchdog.start()
+    try:
+        with proc:
+            for line in proc.stdout:
+                if commit_short in line:
+                    proc.terminate()
+                    return True
+                if stop is not None and stop.is_set():
+                    proc.terminate()
+                    return False
+    finally:
+        watchdog.cancel()
+        if running is not None:
+            with lock:
+                running.pop(dep_id, None)
+    # Only a complete, successful read proves this isn't the commit's
+    # deployment; a killed or failed CLI says nothing.
+    if proc.returncode == 0:
+        _DEPLOYMENT_NOT_FOR_COMMIT.add((dep_id, commit_short))
+    return False
+
+
+def find_deployment_by_metadata(commit_full: str) -> str | None:
+    """
+    Run `vercel list -m githubCommitSha=<sha>` and return the newest
+    deployment listed, or None if the filter is unsupported or lists nothing.
+    One list call and no inspects, so it is cheap enough to poll.
+    """
+    if commit_full in _DEPLOYMENT_BY_COMMIT:
+        return _DEPLOYMENT_BY_COMMIT[commit_full]
+    try:
+        stdout, _, rc = run(
+            ["vercel", "list", "-m", f"githubCommitSha={commit_full}"],
+            cwd=REPO_PATH,
+            check=False,
+            env=_VERCEL_ENV,
+            timeout=VERCEL_LIST_TIMEOUT_SECONDS,
+        )
+    except CommandTimeout as e:
+        print(f"[warn] {e.args[0].splitlines()[0]}")
+        return None
+    dep_ids = parse_deployment_ids(stdout) if rc == 0 else []
+    if not dep_ids:
+        return None
+    print(f"[info from the loop] Matched commit {commit_full[:7]} to deployment {dep_ids[0]} via metadata filter")
+    _DEPLOYMENT_BY_COMMIT[commit_full] = dep_ids[0]
+    return dep_ids[0]
+
+
 def get_deployment_id_for_current_commit() -> str | None:
     """
     Find the Vercel deployment whose commit hash matches the current HEAD.
 
     Works with older Vercel CLI (no --json, no --limit):
 
-    - Run `vercel list` in the linked project dir (uses .vercel/project.json).
-    - Parse deployment IDs from the first column of the table.
-    - For each ID, run `vercel inspect <id>` and search for the short commit hash.
+    - Run `vercel list -m githubCommitSha=<sha>` so Vercel does the matching
+      in one call; the newest deployment listed is the match.
+    - If that is unsupported or lists nothing (e.g. non-GitHub projects),
+      run a plain `vercel list` in the linked project dir (uses
+      .vercel/project.json) and parse deployment IDs from the first column.
+    - For the newest INSPECT_CANDIDATES IDs, run `vercel inspect <id>`
+      (INSPECT_WORKERS at a time) and search for the short commit hash.
     """
 
+    commit_full = get_current_commit_hash(short=False)
     commit_short = get_current_commit_hash(short=True)
+    if commit_full in _DEPLOYMENT_BY_COMMIT:
+        return _DEPLOYMENT_BY_COMMIT[commit_full]
     print(f"[info from the loop] Looking for deployment of commit {commit_short}...")
 
-    env = os.environ.copy()
-    if VERCEL_TOKEN:
-        env["VERCEL_AUTH_TOKEN"] = VERCEL_TOKEN
-    if VERCEL_TEAM_ID:
-        env["VERCEL_TEAM_ID"] = VERCEL_TEAM_ID
+    dep_id = find_deployment_by_metadata(commit_full)
+    if dep_id:
+        return dep_id
 
     cmd = ["vercel", "list"]
-    stdout, stderr, rc = run(cmd, cwd=REPO_PATH, check=False, env=env)
+    try:
+        stdout, stderr, rc = run(
+            cmd, cwd=REPO_PATH, check=False, env=_VERCEL_ENV, timeout=VERCEL_LIST_TIMEOUT_SECONDS
+        )
+    except CommandTimeout as e:
+        print(f"[warn] {e.args[0].splitlines()[0]}")
+        return None
 
     if rc != 0 or not stdout.strip():
         print("[warn] `vercel list` failed or returned no data.")
@@ -296,79 +573,135 @@ def get_deployment_id_for_current_commit() -> str | None:
             print(stderr)
         return None
 
-    dep_ids: list[str] = []
-    for line in stdout.splitlines():
-        raw = line.rstrip()
-        stripped = raw.strip()
-        if not stripped:
-            continue
-        if stripped.startswith("Vercel CLI"):
-            continue
-        lower = stripped.lower()
-        if lower.startswith("age ") or lower.startswith("deployment") or lower.startswith("id "):
-            continue
-        if set(stripped) <= {"─", "━", " ", "┌", "└", "┼", "│", "┐", "┘"}:
-            continue
-
-        parts = stripped.split()
-        if not parts:
-            continue
-
-        dep_id = parts[0]
-        is_url = ".vercel.app" in dep_id or dep_id.startswith("https://")
-        is_raw_id = (
-            dep_id.startswith("dpl_")
-            or (dep_id.isalnum() and len(dep_id) >= 8 and any(ch.isdigit() for ch in dep_id))
-        )
-        if is_url or is_raw_id:
-            dep_ids.append(dep_id)
-
+    dep_ids = parse_deployment_ids(stdout)
     if not dep_ids:
         print("[warn] Could not parse any deployment IDs from `vercel list`.")
         return None
 
     print(f"[info from the loop] Parsed {len(dep_ids)} deployment candidates from `vercel list`.")
 
-    for dep_id in dep_ids:
-        print(f"[debug from the loop] Inspecting deployment {dep_id} for commit {commit_short}...")
-        insp_out, insp_err, _ = run(
-            ["vercel", "inspect", dep_id, "--logs"],
-            cwd=REPO_PATH,
-            check=False,
-            env=env,
-        )
-        combined = f"{insp_out}\n{insp_err}"
-        if commit_short in combined:
-            print(f"[info from the loop] Matched commit {commit_short} to deployment {dep_id}")
-            return dep_id
+    # Inspect the newest candidates a few at a time, but take results in
+    # listing order so the newest matching deployment wins. Once one
+    # matches, queued inspects are cancelled and running ones are killed.
+    # Imported here: the fallback walk only runs when the metadata filter misses.
+    from concurrent.futures import ThreadPoolExecutor
+
+    candidates = dep_ids[:INSPECT_CANDIDATES]
+    stop = threading.Event()
+    lock = threading.Lock()
+    running: dict[str, subprocess.Popen] = {}
+    executor = ThreadPoolExecutor(max_workers=INSPECT_WORKERS)
+    try:
+        futures = [
+            executor.submit(inspect_has_commit, dep_id, commit_short, _VERCEL_ENV, stop, running, lock)
+            for dep_id in candidates
+        ]
+        for dep_id, future in zip(candidates, futures):
+            print(f"[debug from the loop] Inspecting deployment {dep_id} for commit {commit_short}...")
+            if future.result():
+                print(f"[info from the loop] Matched commit {commit_short} to deployment {dep_id}")
+                _DEPLOYMENT_BY_COMMIT[commit_full] = dep_id
+                return dep_id
+    finally:
+        with lock:
+            stop.set()
+            for proc in running.values():
+                proc.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
 
-    print(f"[warn] No deployment found for commit {commit_short} in {len(dep_ids)} candidates.")
+    print(f"[warn] No deployment found for commit {commit_short} in {len(candidates)} candidates.")
     return None
 
 
+def wait_for_deployment(timeout: float = SLEEP_AFTER_PUSH_SECONDS, interval: float = 5.0) -> str | None:
+    """
+    Poll every `interval` seconds, for up to `timeout` seconds, until Vercel
+    has created a deployment for the current HEAD commit. The match is
+    memoized, so the next fetch_latest_build_logs reuses it.
+    Returns the deployment ID, or None if none appeared in time.
+
+    Only the metadata-filtered list is polled. The inspect-every-candidate
+    fallback is left to the single get_deployment_id_for_current_commit
+    call in the next fetch_latest_build_logs.
+    """
+    print(f"[info from the loop] Waiting up to {timeout:.0f}s for Vercel to pick up the new commit...")
+    commit_full = get_current_commit_hash(short=False)
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"[warn] No deployment appeared for the new commit within {timeout:.0f}s.")
+            return None
+        time.sleep(min(interval, remaining))
+        dep_id = find_deployment_by_metadata(commit_full)
+        if dep_id:
+            return dep_id
+
+
+# Typical failure hints
+_FAILURE_MARKERS = (
+    "error ",
+    "failed",
+    "build failed",
+    "exit code 1",
+    "command \"npm run build\" exited with 1",
+)
+# Some positive indicators – you can tune these
+_SUCCESS_MARKERS = (
+    "deployment completed",
+    "build completed",
+    "ready! deployed to",
+)
+# Both marker sets in one case-insensitive alternation, so the log is
+# scanned once and never copied into a lowercased string.
+_MARKER_RE = re.compile(
+    "(?P<fail>" + "|".join(map(re.escape, _FAILURE_MARKERS)) + ")"
+    "|(?P<ok>" + "|".join(map(re.escape, _SUCCESS_MARKERS)) + ")",
+    re.IGNORECASE,
+)
+# Vercel prints the build verdict at the end of the log, so only this much
+# of the tail is scanned, however long the log is.
+MARKER_SCAN_TAIL_CHARS = 32 * 1024
+
+
 def build_looks_successful(logs: str) -> bool:
     """
     Naive heuristic to decide whether the build is 'clean enough'.
     Adjust this to match your project’s real success markers.
     """
-    text = logs.lower()
-
-    possible_failure_markers = [
-        "error ",
-        "failed",
-        "build failed",
-        "exit code 1",
-        "command \"npm run build\" exited with 1",
-    ]
-    if any(marker in text for marker in possible_failure_markers):
-        return False
+    # Any failure marker in the tail wins, wherever it appears there.
+    seen_success = False
+    for match in _MARKER_RE.finditer(logs, max(0, len(logs) - MARKER_SCAN_TAIL_CHARS)):
+        if match.lastgroup == "fail":
+            return False
+        seen_success = True
+    return seen_success
+
 
-    possible_success_markers = [
-        "deployment completed",
-        "build completed",
-        "ready! deployed to",
-    ]
-    return any(marker in text for marker in possible_success_markers)
+def _load_sdk() -> types.SimpleNamespace | None:
+    """
+    Import the OpenHands SDK once and keep the classes in _sdk.
+    Returns None if the SDK is not installed.
+    """
+    global _sdk
+    if _sdk is None:
+        try:
+            from openhands.sdk import LLM, Agent, Conversation, Tool
+            from openhands.tools.file_editor import FileEditorTool
+            from openhands.tools.terminal import TerminalTool
+            from openhands.tools.task_tracker import TaskTrackerTool
+        except ImportError:
+            return None
+        _sdk = types.SimpleNamespace(
+            LLM=LLM,
+            Agent=Agent,
+            Conversation=Conversation,
+            Tool=Tool,
+            FileEditorTool=FileEditorTool,
+            TerminalTool=TerminalTool,
+            TaskTrackerTool=TaskTrackerTool,
+        )
+    return _sdk
 
 
 def run_codex_on_logs(logs: str) -> bool:
@@ -378,62 +711,81 @@ def run_codex_on_logs(logs: str) -> bool:
       - Runs an OpenHands agent (LLM + tools) in the repo workspace
       - Returns True if repo changed, False otherwise
     """
+    global _LOGS_FILE_HASH, _LLM, _AGENT
     print("\n[step] Running OpenHands with latest build logs...")
 
     if not logs.strip():
         print("[info from the loop] No logs provided to agent. Skipping.")
         return False
 
-    try:
-        from openhands.sdk import LLM, Agent, Conversation, Tool
-        from openhands.tools.file_editor import FileEditorTool
-        from openhands.tools.terminal import TerminalTool
-        from openhands.tools.task_tracker import TaskTrackerTool
-    except ImportError:
+    sdk = _load_sdk()
+    if sdk is None:
         print("[error] OpenHands SDK not installed. Install with `pip install openhands-sdk`.")
         return False
 
     logs_file = REPO_PATH / "dev_debug_logs.md"
-    try:
-        logs_file.write_text(
-            f"# Vercel build logs\n\nFetched: {time.strftime('%Y-%m-%d %H:%M:%S %Z')}\n\n```\n{logs}\n```\n",
-            encoding="utf-8",
-        )
-        print(f"[info] Wrote logs to {logs_file} for agent context.")
-    except Exception as e:
-        print(f"[warn] Could not write logs file {logs_file}: {e}")
+    logs_hash = hashlib.blake2b(logs.encode("utf-8", errors="replace"), digest_size=16).digest()
+    if logs_hash == _LOGS_FILE_HASH and logs_file.exists():
+        print(f"[info] Logs unchanged; keeping {logs_file}.")
+    else:
+        # Write a temp file and rename it over the old one, so a reader
+        # never sees a half-written log. The temp file lives in the repo
+        # (same filesystem for the rename), so it is always removed again
+        # rather than left for the next `git add -A`.
+        tmp_name = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=REPO_PATH, prefix=".dev_debug_logs.", delete=False
+            ) as tmp:
+                tmp_name = tmp.name
+                tmp.write(
+                    f"# Vercel build logs\n\nFetched: {time.strftime('%Y-%m-%d %H:%M:%S %Z')}\n\n```\n{logs}\n```\n"
+                )
+            os.replace(tmp_name, logs_file)
+            tmp_name = None
+            _LOGS_FILE_HASH = logs_hash
+            print(f"[info] Wrote logs to {logs_file} for agent context.")
+        except Exception as e:
+            print(f"[warn] Could not write logs file {logs_file}: {e}")
+        finally:
+            if tmp_name is not None:
+                try:
+                    os.unlink(tmp_name)
+                except OSError:
+                    pass
 
     had_changes_before = git_workdir_has_changes()
 
-    system_prompt = (
-        "You are OpenHands running in an autofix loop for a Vercel deployment.\n"
-        "Goal: diagnose the build failure from the Vercel logs and modify the repo to fix it.\n"
-        "Rules:\n"
-        "- Edit files as needed, but do NOT commit.\n"
-        "- Prefer minimal, targeted changes.\n"
-        "- Do NOT rely on local node_modules or locally built artifacts; reason from the Vercel build logs and repo source.\n"
-        "- If lockfile mismatches are indicated, refresh the lockfile accordingly.\n\n"
-        f"The logs are in {logs_file}.\n"
-        "Start by reading that file."
-    )
+    if _AGENT is None:
+        system_prompt = (
+            "You are OpenHands running in an autofix loop for a Vercel deployment.\n"
+            "Goal: diagnose the build failure from the Vercel logs and modify the repo to fix it.\n"
+            "Rules:\n"
+            "- Edit files as needed, but do NOT commit.\n"
+            "- Prefer minimal, targeted changes.\n"
+            "- Do NOT rely on local node_modules or locally built artifacts; reason from the Vercel build logs and repo source.\n"
+            "- If lockfile mismatches are indicated, refresh the lockfile accordingly.\n\n"
+            f"The logs are in {logs_file}.\n"
+            "Start by reading that file."
+        )
 
-    llm = LLM(
-        model=LLM_MODEL,
-        api_key=LLM_API_KEY,
-        base_url=LLM_BASE_URL,
-    )
+        _LLM = sdk.LLM(
+            model=LLM_MODEL,
+            api_key=LLM_API_KEY,
+            base_url=LLM_BASE_URL,
+        )
 
-    agent = Agent(
-        llm=llm,
-        tools=[
-            Tool(name=TerminalTool.name),
-            Tool(name=FileEditorTool.name),
-            Tool(name=TaskTrackerTool.name),
-        ],
-        system_prompt=system_prompt,
-    )
+        _AGENT = sdk.Agent(
+            llm=_LLM,
+            tools=[
+                sdk.Tool(name=sdk.TerminalTool.name),
+                sdk.Tool(name=sdk.FileEditorTool.name),
+                sdk.Tool(name=sdk.TaskTrackerTool.name),
+            ],
+            system_prompt=system_prompt,
+        )
 
-    conversation = Conversation(agent=agent, workspace=str(REPO_PATH))
+    conversation = sdk.Conversation(agent=_AGENT, workspace=str(REPO_PATH))
     conversation.send_message("Fix the Vercel build based on the logs file specified in the system prompt.")
     try:
         conversation.run(max_turns=OPENHANDS_MAX_TURNS)
@@ -455,40 +807,55 @@ def git_commit_and_push() -> bool:
     """
     print("\n[step] Git add/commit/push...")
 
-    run(["git", "add", "-A"], cwd=REPO_PATH)
-
+    # Separate argv calls, each with its own timeout, so a hung step is the
+    # process that gets killed (a shell chain would only lose /bin/sh).
     commit_msg = "chore: auto-fix by openhands based on Vercel build logs"
+    run(GIT + ["add", "-A"], check=True, timeout=GIT_TIMEOUT_SECONDS)
+
     stdout, stderr, returncode = run(
-        ["git", "commit", "-m", commit_msg],
-        cwd=REPO_PATH,
-        check=False,
+        GIT + ["commit", "-m", commit_msg], check=False, timeout=GIT_TIMEOUT_SECONDS
     )
-
     if returncode != 0:
         if "nothing to commit" in stdout.lower() or "nothing to commit" in stderr.lower():
             print("[info from the loop] Nothing to commit. Skipping push.")
             return False
         raise RuntimeError(
-            f"git commit failed unexpectedly:\nSTDOUT:\n{stdout}\nSTDERR:\n{stderr}"
+            f"git commit failed:\nSTDOUT:\n{stdout}\nSTDERR:\n{stderr}"
         )
 
+    # HEAD moved; drop the cached hash.
+    _head_sha.cache_clear()
+
     print("[info from the loop] Commit created:")
     print(stdout)
 
-    stdout, stderr, returncode = run(
-        ["git", "push", GIT_REMOTE, GIT_BRANCH],
-        cwd=REPO_PATH,
-        check=False,
-    )
-    if returncode != 0:
-        raise RuntimeError(
-            f"git push failed:\nSTDOUT:\n{stdout}\nSTDERR:\n{stderr}"
-        )
-
+    run(GIT + ["push", GIT_REMOTE, GIT_BRANCH], check=True, timeout=GIT_PUSH_TIMEOUT_SECONDS)
     print("[info from the loop] git push completed.")
     return True
 
 
+def load_loop_state() -> dict:
+    """Return the contents of _STATE_FILE, or {} if it is missing or unreadable."""
+    try:
+        return json.loads(_STATE_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_loop_state(**updates) -> None:
+    """
+    Merge `updates` into _STATE_FILE. Does nothing when .git is a file
+    (worktrees, submodules); a failed write only warns, since the state
+    just lets the next run exit early.
+    """
+    if not _STATE_FILE.parent.is_dir():
+        return
+    try:
+        _STATE_FILE.write_text(json.dumps({**load_loop_state(), **updates}), encoding="utf-8")
+    except OSError as e:
+        print(f"[warn] Could not save loop state to {_STATE_FILE}: {e}")
+
+
 # =========================
 # MAIN LOOP
 # =========================
@@ -500,6 +867,15 @@ def main():
     print(f"Branch: {GIT_BRANCH}")
     print(f"URL:    {PROD_URL}")
 
+    # Skip the whole loop if HEAD is the commit a previous run saw succeed
+    # and Vercel's newest deployment of it is still Ready. A redeploy of the
+    # same SHA can fail, so the saved state alone isn't trusted.
+    head = get_current_commit_hash(short=False)
+    if load_loop_state().get("last_green_sha") == head and latest_deployment_ready(head):
+        print(f"[info from the loop] Commit {head[:7]} already built successfully; its latest deployment is Ready.")
+        print("[done] Nothing to do.")
+        return
+
     for i in range(1, MAX_ITERATIONS + 1):
         print(f"\n==============================")
         print(f"Iteration {i}/{MAX_ITERATIONS}")
@@ -512,6 +888,7 @@ def main():
             continue
 
         if build_looks_successful(logs):
+            save_loop_state(last_green_sha=get_current_commit_hash(short=False))
             print("[info from the loop] Build looks successful 🎉")
             print("[done] Stopping loop.")
             return
@@ -526,8 +903,9 @@ def main():
             print("[info from the loop] No code changes actually pushed. Stopping loop.")
             return
 
-        print(f"[info from the loop] Sleeping {SLEEP_AFTER_PUSH_SECONDS}s while Vercel builds...")
-        time.sleep(SLEEP_AFTER_PUSH_SECONDS)
+        # Poll for the new commit's deployment instead of sleeping blindly;
+        # the next fetch then blocks in `vercel inspect --wait` until it ends.
+        wait_for_deployment()
 
     print(f"[stop] Reached MAX_ITERATIONS={MAX_ITERATIONS}. Exiting.")
 